@@ -1,10 +1,41 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Optional
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from pydantic_ai import Agent
 from pydantic_ai.exceptions import UnexpectedModelBehavior
-from app.agent import weather_agent
+from pydantic_ai.messages import ModelMessage, PartDeltaEvent, PartStartEvent, TextPart, TextPartDelta
+from app.agent import mcp_server, weather_agent
 import os
 from fastapi.staticfiles import StaticFiles
 
-app = FastAPI(title="FastAPI PydanticAI WebSocket Agent")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the MCP SSE session once and share it across every agent run,
+    # instead of reconnecting and re-listing tools on each message.
+    async with weather_agent:
+        # Fetch the tool definitions now so the first user message doesn't pay
+        # for tool discovery.
+        await mcp_server.list_tools()
+        yield
+
+
+app = FastAPI(title="FastAPI PydanticAI WebSocket Agent", lifespan=lifespan)
+
+# Outbound chunks buffered per connection before producers have to wait on the client.
+SEND_QUEUE_SIZE = 32
+
+# Agent runs allowed in flight at once on a single connection.
+MAX_CONCURRENT_RUNS = 4
+
+# Messages accepted per connection (running plus waiting for a run slot); once
+# reached, the receive loop stops reading and the client is pushed back on.
+MAX_PENDING_MESSAGES = MAX_CONCURRENT_RUNS + 4
+
+# Queue items are (seq, text); text None marks the end of reply `seq`.
+Chunk = tuple[int, Optional[str]]
 
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
@@ -12,24 +43,130 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 async def root():
     return {"message": "Welcome to the FastAPI PydanticAI Agent WebSocket Server. Go to /static/index.html to chat."}
 
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
+async def _drain(websocket: WebSocket, queue: asyncio.Queue[Chunk]) -> None:
+    """Send queued reply chunks to the client as JSON frames tagged with their seq."""
+    pending: Optional[Chunk] = None
+    while True:
+        seq, text = pending or await queue.get()
+        pending = None
+        if text is None:
+            await websocket.send_text(json.dumps({"seq": seq, "done": True}))
+            continue
+        # Chunks of the same reply that piled up during the previous send go out
+        # as one frame; anything else is held back for the next iteration.
+        parts = [text]
+        while not queue.empty():
+            item = queue.get_nowait()
+            if item[0] != seq or item[1] is None:
+                pending = item
+                break
+            parts.append(item[1])
+        await websocket.send_text(json.dumps({"seq": seq, "delta": "".join(parts)}))
+
+class _Conversation:
+    """Message history of one socket, with turns recorded in the order they were sent.
+
+    Runs can finish out of order; a finished turn is held back until every
+    earlier turn has been recorded, so the model always replays the
+    conversation as the user wrote it.
+    """
+
+    def __init__(self) -> None:
+        self.messages: list[ModelMessage] = []
+        self._next_seq = 1
+        self._finished: dict[int, list[ModelMessage]] = {}
+
+    def finish(self, seq: int, new_messages: list[ModelMessage]) -> None:
+        self._finished[seq] = new_messages
+        while self._next_seq in self._finished:
+            self.messages.extend(self._finished.pop(self._next_seq))
+            self._next_seq += 1
+
+async def _stream_run(
+    seq: int,
+    user_message: str,
+    message_history: list[ModelMessage],
+    queue: asyncio.Queue[Chunk],
+) -> list[ModelMessage]:
+    """Run the full agent graph, streaming the text of every model response into the send queue.
+
+    Unlike ``run_stream``, which stops at the first text output, this keeps
+    going through tool calls, so a reply like "creating the user now" plus a
+    ``create_user`` call still runs the tool and streams the follow-up answer.
+    """
+    sent_text = False
+    async with weather_agent.iter(user_message, message_history=message_history) as run:
+        async for node in run:
+            if not Agent.is_model_request_node(node):
+                continue
+            async with node.stream(run.ctx) as request_stream:
+                async for event in request_stream:
+                    if isinstance(event, PartStartEvent) and isinstance(event.part, TextPart):
+                        # Separate text from successive model responses / parts.
+                        text = ("\n\n" if sent_text else "") + event.part.content
+                    elif isinstance(event, PartDeltaEvent) and isinstance(event.delta, TextPartDelta):
+                        text = event.delta.content_delta
+                    else:
+                        continue
+                    if text:
+                        await queue.put((seq, text))
+                        sent_text = True
+    return run.result.new_messages()
+
+async def _handle(
+    seq: int,
+    user_message: str,
+    conversation: _Conversation,
+    sem: asyncio.Semaphore,
+    backlog: asyncio.Semaphore,
+    queue: asyncio.Queue[Chunk],
+) -> None:
+    """Run the agent for one user message and stream its reply into the send queue."""
     try:
-        while True:
-            # Receive message from client
-            user_message = await websocket.receive_text()
-            
+        async with sem:
+            # Failed runs still finish their turn (with no messages) so later turns aren't held back.
+            new_messages: list[ModelMessage] = []
             try:
-                result = await weather_agent.run(user_message)
-                
-                await websocket.send_text(result.output)
+                new_messages = await _stream_run(seq, user_message, list(conversation.messages), queue)
                 
             except UnexpectedModelBehavior as e:
-                await websocket.send_text(f"Error: {str(e)}")
+                await queue.put((seq, f"Error: {str(e)}"))
             except Exception as e:
                 print(f"Agent Run Error: {e}")
-                await websocket.send_text(f"Processing Error: {str(e)}")
+                await queue.put((seq, f"Processing Error: {str(e)}"))
+
+            conversation.finish(seq, new_messages)
+            await queue.put((seq, None))
+    finally:
+        # Free this message's backlog slot so the receive loop can read another.
+        backlog.release()
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    await websocket.accept()
+    # Conversation so far on this socket; replaying it keeps the prompt prefix
+    # stable across turns so the model backend can reuse its prefix cache.
+    conversation = _Conversation()
+    queue: asyncio.Queue[Chunk] = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+    sem = asyncio.Semaphore(MAX_CONCURRENT_RUNS)
+    backlog = asyncio.Semaphore(MAX_PENDING_MESSAGES)
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(_drain(websocket, queue))
+            seq = 0
+            while True:
+                # Wait for room in the backlog before reading the next frame, so a
+                # fast client can't queue unbounded runs.
+                await backlog.acquire()
+                # Receive message from client; replies are tagged with the
+                # message's position so the client can order them.
+                user_message = await websocket.receive_text()
+                seq += 1
+                tg.create_task(_handle(seq, user_message, conversation, sem, backlog, queue))
                 
-    except WebSocketDisconnect:
-        print("Client disconnected")
+    except* WebSocketDisconnect:
+        # Leaving the TaskGroup on disconnect has already cancelled every
+        # in-flight run (aborting its model request) and the sender.
+        print("Client disconnected, in-flight runs cancelled")
+    except* Exception as eg:
+        print(f"Connection Error: {eg.exceptions}")
@@ -1,27 +1,203 @@
 from fastmcp import FastMCP
 import uuid
 import asyncio
+import random
+import time
 import httpx
 from typing import Optional, List, Dict
-import json
+from collections import OrderedDict
+import orjson
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import base64
 from datetime import datetime
+import contextlib
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Log records are handed to a background thread through a queue, so the event
+# loop never blocks on writing to stdout/stderr.
+logger = logging.getLogger(__name__)
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+logger.propagate = False
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# One keep-alive HTTP/2 client shared by every autobot API call, created on first use.
+_client: Optional[httpx.AsyncClient] = None
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            http2=True,
+            timeout=30.0,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+        )
+    return _client
+
+def _close_client() -> None:
+    # Called once at process shutdown, not from a FastMCP lifespan: that hook
+    # runs per client session, and the client is shared by all sessions.
+    global _client
+    if _client is not None:
+        # The server's event loop is gone by now; if the pooled connections
+        # can't be closed cleanly the OS reclaims them on exit anyway.
+        with contextlib.suppress(RuntimeError):
+            asyncio.run(_client.aclose())
+        _client = None
 
 mcp = FastMCP(name="User CRUD Server")
 
-users_db: Dict[str, dict] = {}
+_BOT_URL = "https://api-test.autobot.live/bot_executions"
+_BOT_PAYLOAD_TEMPLATE = {
+    "bot_id": "695b46b802274a22219c4609",
+    "test_events": {
+        "start": []
+    }
+}
+
+# Autobot API bearer token, cached until shortly before its JWT "exp".
+# AUTOBOT_REFRESH_TOKEN + AUTOBOT_COGNITO_CLIENT_ID, when set, are used to mint
+# fresh ID tokens from Cognito; otherwise AUTOBOT_TOKEN is used as-is.
+_COGNITO_URL = os.getenv("AUTOBOT_COGNITO_URL", "https://cognito-idp.ap-south-1.amazonaws.com/")
+_TOKEN_REFRESH_MARGIN = 60.0
+_token_cache = {"value": None, "exp": 0.0, "headers": None}
+_token_lock = asyncio.Lock()
+
+def _jwt_exp(token: str) -> float:
+    """Read the ``exp`` claim of a JWT without verifying it; opaque tokens never expire."""
+    try:
+        claims = token.split(".")[1]
+        claims += "=" * (-len(claims) % 4)
+        return float(orjson.loads(base64.urlsafe_b64decode(claims))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return float("inf")
+
+async def _fetch_token() -> str:
+    refresh_token = os.getenv("AUTOBOT_REFRESH_TOKEN")
+    client_id = os.getenv("AUTOBOT_COGNITO_CLIENT_ID")
+    if refresh_token and client_id:
+        resp = await _get_client().post(
+            _COGNITO_URL,
+            content=orjson.dumps({
+                "AuthFlow": "REFRESH_TOKEN_AUTH",
+                "ClientId": client_id,
+                "AuthParameters": {"REFRESH_TOKEN": refresh_token},
+            }),
+            headers={
+                "X-Amz-Target": "AWSCognitoIdentityProviderService.InitiateAuth",
+                "Content-Type": "application/x-amz-json-1.1",
+            },
+        )
+        resp.raise_for_status()
+        return resp.json()["AuthenticationResult"]["IdToken"]
+
+    token = os.getenv("AUTOBOT_TOKEN")
+    if not token:
+        raise RuntimeError(
+            "No autobot credentials: set AUTOBOT_TOKEN, or AUTOBOT_REFRESH_TOKEN and AUTOBOT_COGNITO_CLIENT_ID"
+        )
+    return token
+
+async def _get_auth_headers() -> dict:
+    """Return the Authorization headers for the cached token, refreshing it if due."""
+    if time.time() > _token_cache["exp"] - _TOKEN_REFRESH_MARGIN:
+        async with _token_lock:
+            # Another caller may have refreshed while we waited for the lock.
+            if time.time() > _token_cache["exp"] - _TOKEN_REFRESH_MARGIN:
+                token = await _fetch_token()
+                _token_cache["value"] = token
+                _token_cache["exp"] = _jwt_exp(token)
+                _token_cache["headers"] = {"Authorization": f"Bearer {token}"}
+    return _token_cache["headers"]
+
+# Users are stored column-wise: one list per field plus an id -> row index.
+# Scans walk contiguous lists instead of one dict per user.
+# The index is kept in least- to most-recently-used order; once MAX_USERS is
+# reached, creating a user evicts the least recently used one.
+MAX_USERS = 100_000
+_ids: List[str] = []
+_names: List[str] = []
+_emails: List[str] = []
+_roles: List[str] = []
+_idx: "OrderedDict[str, int]" = OrderedDict()
+
+# Serialized users://list payload, rebuilt on the first read after a mutation.
+_users_json_cache: Optional[str] = None
+
+# Read-tool results keyed by (tool, args). Entries live for a short window so
+# back-to-back identical calls within one agent step collapse to a lookup;
+# any mutation drops them all.
+_READ_CACHE_TTL = 0.2
+_READ_CACHE_MAX = 1024
+_read_cache: Dict[tuple, tuple] = {}
+
+def _users_changed() -> None:
+    global _users_json_cache
+    _users_json_cache = None
+    _read_cache.clear()
+
+def _cached_read(key: tuple, compute):
+    now = time.monotonic()
+    hit = _read_cache.get(key)
+    if hit is not None and now - hit[0] < _READ_CACHE_TTL:
+        return hit[1]
+    value = compute()
+    if len(_read_cache) >= _READ_CACHE_MAX:
+        _read_cache.clear()
+    _read_cache[key] = (now, value)
+    return value
+
+def _row(i: int) -> dict:
+    return {"id": _ids[i], "name": _names[i], "email": _emails[i], "role": _roles[i]}
+
+def _rows():
+    for user_id, name, email, role in zip(_ids, _names, _emails, _roles):
+        yield {"id": user_id, "name": name, "email": email, "role": role}
+
+def _row_index(user_id: str) -> int:
+    i = _idx.get(user_id)
+    if i is None:
+        raise ValueError(f"User with ID {user_id} not found")
+    _idx.move_to_end(user_id)
+    return i
+
+def _remove_row(i: int) -> None:
+    # Swap-remove: move the last row into the hole so deletes stay O(1).
+    last = len(_ids) - 1
+    if i != last:
+        _ids[i] = _ids[last]
+        _names[i] = _names[last]
+        _emails[i] = _emails[last]
+        _roles[i] = _roles[last]
+        _idx[_ids[i]] = i
+    _ids.pop()
+    _names.pop()
+    _emails.pop()
+    _roles.pop()
 
 @mcp.tool()
 def create_user(name: str, email: str, role: str = "user") -> dict:
     """Create a new user."""
-    user_id = str(uuid.uuid4())
-    user = {
-        "id": user_id,
-        "name": name,
-        "email": email,
-        "role": role
-    }
-    users_db[user_id] = user
-    return user
+    user_id = uuid.uuid4().hex
+    if len(_idx) >= MAX_USERS:
+        _, evicted = _idx.popitem(last=False)
+        _remove_row(evicted)
+    _ids.append(user_id)
+    _names.append(name)
+    _emails.append(email)
+    _roles.append(role)
+    _idx[user_id] = len(_ids) - 1
+    _users_changed()
+    return {"id": user_id, "name": name, "email": email, "role": role}
 
 @mcp.tool()
 def ping() -> str:
@@ -31,10 +207,7 @@ def ping() -> str:
 @mcp.tool()
 def read_user(user_id: str) -> dict:
     """Get details of a user by their ID."""
-    user = users_db.get(user_id)
-    if not user:
-        raise ValueError(f"User with ID {user_id} not found")
-    return user
+    return _cached_read(("read_user", user_id), lambda: _row(_row_index(user_id)))
 
 @mcp.tool()
 def list_users() -> List[dict]:
@@ -47,38 +220,40 @@ def list_users() -> List[dict]:
     Returns:
         List[dict]: A list of all users with their complete information.
     """
-    return list(users_db.values())
+    return _cached_read(("list_users",), lambda: list(_rows()))
 
 @mcp.resource("users://list")
 def list_users_resource() -> str:
     """Get a list of all users as a JSON string."""
-    import json
-    return json.dumps(list(users_db.values()), indent=2)
+    global _users_json_cache
+    if _users_json_cache is None:
+        _users_json_cache = orjson.dumps(list(_rows())).decode()
+    return _users_json_cache
 
 @mcp.tool()
 def update_user(user_id: str, name: Optional[str] = None, email: Optional[str] = None, role: Optional[str] = None) -> dict:
     """Update a user's details."""
-    user = users_db.get(user_id)
-    if not user:
-        raise ValueError(f"User with ID {user_id} not found")
+    i = _row_index(user_id)
     
     if name is not None:
-        user["name"] = name
+        _names[i] = name
     if email is not None:
-        user["email"] = email
+        _emails[i] = email
     if role is not None:
-        user["role"] = role
+        _roles[i] = role
         
-    users_db[user_id] = user
-    return user
+    _users_changed()
+    return _row(i)
 
 @mcp.tool()
 def delete_user(user_id: str) -> str:
     """Delete a user."""
-    if user_id not in users_db:
+    i = _idx.pop(user_id, None)
+    if i is None:
         raise ValueError(f"User with ID {user_id} not found")
     
-    del users_db[user_id]
+    _remove_row(i)
+    _users_changed()
     return f"User {user_id} deleted successfully"
 
 
@@ -101,69 +276,81 @@ def onboard_user(name: str) -> str:
     """
     return f"Welcome {name}! We're excited to have you on board. Please provide your email and role so we can set up your account."
 
-async def wait_for_bot_completion(execution_id: str, token: str, max_retries: int = 60, poll_interval: int = 5):
+async def wait_for_bot_completion(execution_id: str, timeout: float = 300.0, initial_delay: float = 0.5, max_delay: float = 10.0):
     """
     Poll for bot execution completion.
     
+    Polls start at ``initial_delay`` seconds apart and back off by 1.5x (with a
+    little jitter) up to ``max_delay``, so short runs are noticed quickly and
+    long runs are not hammered. Gives up once ``timeout`` seconds have passed.
+    
     Returns:
         dict: Complete execution data with all node results
     """
 
-    status_url = f"https://api-test.autobot.live/bot_executions/{execution_id}"
-    headers = {"Authorization": f"Bearer {token}"}
+    status_url = f"{_BOT_URL}/{execution_id}"
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        for attempt in range(max_retries):
-            try:
-                resp = await client.get(status_url, headers=headers)
-                resp.raise_for_status()
+    client = _get_client()
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            # Re-read the cached token each poll so long waits pick up refreshes.
+            resp = await client.get(status_url, headers=await _get_auth_headers())
+            resp.raise_for_status()
 
-                data = resp.json()
-                state = data.get("state") or data.get("status")
+            data = resp.json()
+            state = data.get("state") or data.get("status")
                 
-                print(f"[Poll {attempt + 1}/{max_retries}] State: {state}")
+            logger.debug("[Poll %d] State: %s", attempt, state)
 
-                if state in ["SUCCEEDED", "COMPLETED"]:
-                    print("✓ Bot execution completed successfully")
-                    return data
-                
-                elif state == "FAILED":
-                    errors = data.get('errors') or 'Unknown error'
-                    raise RuntimeError(f"Bot execution failed: {errors}")
-                
-                elif state in ["RUNNING", "PENDING", "QUEUED"]:
-                    await asyncio.sleep(poll_interval)
+            if state in ["SUCCEEDED", "COMPLETED"]:
+                logger.info("✓ Bot execution completed successfully")
+                return data
                 
-                else:
-                    print(f"Warning: Unexpected state '{state}'")
-                    await asyncio.sleep(poll_interval)
-            except httpx.HTTPError as e:
-                print(f"✗ Network error during polling: {e}")
-                await asyncio.sleep(poll_interval)
-
-        raise TimeoutError(
-            f"Bot execution did not complete after {max_retries * poll_interval} seconds"
-        )
-
-async def get_node_results(execution_id: str, token: str, node_names: list[str]) -> dict:
-
-    headers = {"Authorization": f"Bearer {token}"}
-    node_results = {}
-    
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        for node_name in node_names:
-            try:
-                url = f"https://api-test.autobot.live/bot_executions/{execution_id}/{node_name}/results"
-                resp = await client.get(url, headers=headers)
-                resp.raise_for_status()
+            elif state == "FAILED":
+                errors = data.get('errors') or 'Unknown error'
+                raise RuntimeError(f"Bot execution failed: {errors}")
                 
-                node_results[node_name] = resp.json()
-                print(f"✓ Fetched results for node: {node_name}")
-                
-            except httpx.HTTPError as e:
-                node_results[node_name] = {"error": str(e)}
-    
-    return node_results
+            elif state not in ["RUNNING", "PENDING", "QUEUED"]:
+                logger.warning("Unexpected state '%s'", state)
+        except httpx.HTTPError as e:
+            logger.warning("✗ Network error during polling: %s", e)
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        await asyncio.sleep(min(delay + random.uniform(0, 0.25), remaining))
+        delay = min(delay * 1.5, max_delay)
+
+    raise TimeoutError(
+        f"Bot execution did not complete after {timeout} seconds"
+    )
+
+async def _fetch_node_result(client: httpx.AsyncClient, execution_id: str, headers: dict, node_name: str) -> dict:
+    url = f"{_BOT_URL}/{execution_id}/{node_name}/results"
+    resp = await client.get(url, headers=headers)
+    resp.raise_for_status()
+    logger.debug("✓ Fetched results for node: %s", node_name)
+    return resp.json()
+
+async def get_node_results(execution_id: str, node_names: list[str]) -> dict:
+
+    headers = await _get_auth_headers()
+    client = _get_client()
+
+    # The per-node fetches are independent, so issue them all at once.
+    results = await asyncio.gather(
+        *[_fetch_node_result(client, execution_id, headers, node_name) for node_name in node_names],
+        return_exceptions=True,
+    )
+
+    return {
+        node_name: {"error": str(result)} if isinstance(result, Exception) else result
+        for node_name, result in zip(node_names, results)
+    }
 
 def filter_intermediate_nodes(results: dict) -> list[str]:
    
@@ -176,82 +363,59 @@ def filter_intermediate_nodes(results: dict) -> list[str]:
     ]
 
 @mcp.tool()
-async def run_bot(url: str, payload: Optional[dict] = None) -> str:
-    payload = {
-        "bot_id": "695b46b802274a22219c4609",
-        "test_events": {
-            "start": []
-        }
-    }
-    url = 'https://api-test.autobot.live/bot_executions'
-    token = 'eyJraWQiOiJuaFU2eWlkdGpleSthUjd3SURWRXcyeDNrclNibTYxUEV3K1RrZ056UkNZPSIsImFsZyI6IlJTMjU2In0.eyJzdWIiOiI5ZmYxNmM2Yi1lMDBiLTRiMmItODQ4My1hN2QxYmFkNGYxMmQiLCJlbWFpbF92ZXJpZmllZCI6dHJ1ZSwiaXNzIjoiaHR0cHM6XC9cL2NvZ25pdG8taWRwLmFwLXNvdXRoLTEuYW1hem9uYXdzLmNvbVwvYXAtc291dGgtMV90SFRSTlpjZ3YiLCJwaG9uZV9udW1iZXJfdmVyaWZpZWQiOmZhbHNlLCJjb2duaXRvOnVzZXJuYW1lIjoiYW1pdEBzaHVueWVrYS5jb20iLCJhdWQiOiI3bmJmZG9vbTFzcnJkbW1ybnU0ZTdobnI3aiIsImV2ZW50X2lkIjoiZmMxNjI2N2MtYjNjMy00YzYyLWIyNmItMzZmZDZhMGI1YTVmIiwidG9rZW5fdXNlIjoiaWQiLCJhdXRoX3RpbWUiOjE3Njc1ODk1MjYsIm5hbWUiOiJBbWl0IENob3RhbGl5YSIsInBob25lX251bWJlciI6Iis5MTgwODgyNjMwMTAiLCJleHAiOjE3Njc2MTE2NTEsImlhdCI6MTc2NzYwODA1MSwiZW1haWwiOiJhbWl0QHNodW55ZWthLmNvbSJ9.WF4tf_1jsCqUvktg5NbSpvfURybpItXzfmLNBpNu-wp9DcUN_Y23_W3zpVWCJk5riWTxJdB68aZwOlev-H0Q5utElc31ad-Q4aX-KkIRn5BSPcM9h3DtejfoGjJM8OX5H3Dc_2bAepfOGNKDbHPIWoT14Bs9CoTc9Oa0a_f3m931bxEbbEpeo4SuQqkBCaxqBhQ45NJG7svGpda7NBVZPbfS86BB-QHgwZa75CttGHB7BoCJ7qKqaGqJcKFA8dQXMaGgWgD-px7aSuEQ_hos3vkIsNT5A30V8ZWiWqOosFCZqmPCorlPn-c5ClgPk8H1A8iYM9IlpzCmBTB_o0ZMVw'
-    headers = {
-        'Authorization': f'Bearer {token}'
-    }
-    async with httpx.AsyncClient() as client:
-        try:
-            # api_id = "M-0MzaXoZkZ5gQyRyBkr0Q"
-            # api_key = "ca24147a809ba4d95ac6500b812dc882"
-            # headers = {
-            #     "X-API-ID": api_id,
-            #     "X-API-KEY": api_key,
-            #     "Content-Type": "application/json"
-            # }
-            response = await client.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            print('RESPONSE STATUS: ', response.status_code)
-
-            execution = response.json()
-            print('EXECUTION: ', execution)
-            execution_id = execution["_id"]
-            print('EXECUTION ID: ', execution_id)
-
-            # 2️⃣ Wait for completion
-            final_result = await wait_for_bot_completion(
-                execution_id=execution_id,
-                token=token
-            )
-            state = final_result.get("state")
-
-            all_results = final_result.get("results", {})
-
-            intermediate_nodes = filter_intermediate_nodes(all_results)
-
-            node_results = await get_node_results(
-                execution_id=execution_id,
-                token=token,
-                node_names=intermediate_nodes
-            )
-
-            if state == "COMPLETED" or state == "SUCCEEDED":
-                return json.dumps({
-                    "success": True,
-                    "execution_id": execution_id,
-                    "state": state,
-                    "bot_name": final_result.get("bot_name"),
-                    "total_intermediate_nodes": len(intermediate_nodes),
-                    "node_results": node_results,
-                    "full_execution_data": final_result
-                }, indent=2)
-
-        except Exception as e:
-            return f"Error triggering bot: {str(e)}"
+async def run_bot(url: str = _BOT_URL, payload: Optional[dict] = None) -> str:
+    # The bearer token is only ever sent to the autobot executions endpoint.
+    if url.rstrip("/") != _BOT_URL:
+        return f"Error triggering bot: only {_BOT_URL} is supported"
+    payload = {**_BOT_PAYLOAD_TEMPLATE, **(payload or {})}
+    client = _get_client()
+    try:
+        headers = await _get_auth_headers()
+        response = await client.post(url, json=payload, headers=headers)
+        response.raise_for_status()
+
+        execution = response.json()
+        execution_id = execution["_id"]
+        logger.info("Started bot execution %s", execution_id)
+
+        # 2️⃣ Wait for completion
+        final_result = await wait_for_bot_completion(
+            execution_id=execution_id
+        )
+        state = final_result.get("state")
 
+        all_results = final_result.get("results", {})
 
+        intermediate_nodes = filter_intermediate_nodes(all_results)
 
-if __name__ == "__main__":
-    mcp.run(transport='sse', port=8001)
+        node_results = await get_node_results(
+            execution_id=execution_id,
+            node_names=intermediate_nodes
+        )
 
+        if state == "COMPLETED" or state == "SUCCEEDED":
+            return orjson.dumps({
+                "success": True,
+                "execution_id": execution_id,
+                "state": state,
+                "bot_name": final_result.get("bot_name"),
+                "total_intermediate_nodes": len(intermediate_nodes),
+                "node_results": node_results,
+                "full_execution_data": final_result
+            }, option=orjson.OPT_INDENT_2).decode()
 
-# introduce 2 features in autobotai :
-# 1. Add optinal input json scheema and validation for listener 
-# 2. End Node should allow output selection
+    except Exception as e:
+        return f"Error triggering bot: {str(e)}"
 
 
 
-# M-0MzaXoZkZ5gQyRyBkr0Q api key-id
-# ca24147a809ba4d95ac6500b812dc882 api key-secret
+if __name__ == "__main__":
+    try:
+        mcp.run(transport='sse', port=8001)
+    finally:
+        _close_client()
 
 
-# Lister secret: ba8a8dd1b2c04aa7a26b552cacbe44b5
-# https://api-test.autobot.live/integrations/generic/webhook/695bacacf573e080d8319bdf
\ No newline at end of file
+# introduce 2 features in autobotai :
+# 1. Add optinal input json scheema and validation for listener 
+# 2. End Node should allow output selection